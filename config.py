@@ -1,38 +1,41 @@
-config = {
+from dataclasses import dataclass
 
-    # Rough elapsed time the program has been running
-    "ELAPSED_TIME": 0,
 
-    # Total allowed running length of program; incremented by sleep_mode
+@dataclass(slots=True)
+class Config:
+    """Tunable values for the idle usage checker."""
+
+    # Total allowed running length of program; enforced by a timer
     # (seconds * minutes * hours)
-    "RUNNING_DURATION": 60 * 60 * 4,
+    RUNNING_DURATION: int = 60 * 60 * 4
 
     # (seconds * minutes) - Duration of Sleep Mode between resource check
-    "SLEEP_MODE_LENGTH": 60 * 6,
+    SLEEP_MODE_LENGTH: int = 60 * 6
 
     # Maximum for acceptable CPU usage, in %
-    "CPU_THRESHOLD": 30,
+    CPU_THRESHOLD: int = 30
 
     # Maximum for acceptable RAM usage, in %
-    "MEMORY_THRESHOLD": 55,
+    MEMORY_THRESHOLD: int = 55
 
     # Number of resource checks required to determine heavy usage
-    "RESOURCE_CHECKS": 3,
+    RESOURCE_CHECKS: int = 3
 
     # Number of seconds between resource checks
-    "RESOURCE_CHECK_INTERVAL": 3,
+    RESOURCE_CHECK_INTERVAL: int = 3
 
     # Failsafe value in case checks keep returning active/inactive
-    "MAX_RESOURCE_CHECKS": 10,
+    MAX_RESOURCE_CHECKS: int = 10
 
     # Number of passed resource checks allowed before terminating program
-    "MAX_PASSED_CHECKS": 3,
+    MAX_PASSED_CHECKS: int = 3
 
     # Number of seconds between presence checks
-    "PRESENCE_WAIT_TIME": 60,
+    PRESENCE_WAIT_TIME: int = 60
 
     # Number of checks for user presence;
     # With PRESENCE_WAIT_TIME of 60, 15 checks = 15 minutes
-    "PRESENCE_CHECK_COUNT": 12
+    PRESENCE_CHECK_COUNT: int = 12
+
 
-}
+config = Config()
@@ -1,10 +1,15 @@
 import os
 import sys
+import queue
+import argparse
 import psutil
 import win32api
-import boto3
+import win32con
 import logging
-from time import sleep
+import logging.handlers
+import threading
+import uuid
+from time import monotonic
 
 from config import config
 
@@ -14,6 +19,26 @@ Task Scheduler and still get user input information using
 win32api.GetLastInputInfo.  There are no issues when running manually.
 """
 
+# SNS accepts at most 10 entries per publish_batch call
+SNS_BATCH_SIZE = 10
+SNS_PUBLISH_ATTEMPTS = 3
+
+# Windows ends the process once the handler returns for these events
+_TERMINATING_CTRL_EVENTS = (
+    win32con.CTRL_CLOSE_EVENT,
+    win32con.CTRL_LOGOFF_EVENT,
+    win32con.CTRL_SHUTDOWN_EVENT,
+)
+# Must stay under the ~5 s Windows allows before forcing termination
+TEARDOWN_TIMEOUT = 4
+
+_NOTIFY_TMPL = (
+    "Your CPU usage was recorded at {cpu}% "
+    "and your RAM usage was recorded at {mem}%. "
+    "Allowed maximums: CPU: {cpu_thr}% RAM: {mem_thr}%. "
+    "Did you leave a task running?"
+)
+
 
 class Idle_Usage_Checker:
     def __init__(self, **kwargs) -> None:
@@ -34,31 +59,55 @@ class Idle_Usage_Checker:
             formatter = logging.Formatter(
                 "%(asctime)s:%(levelname)s:%(name)s:%(message)s"
             )
-            file_handler = logging.FileHandler("idle_usage_checker_logs.log")
+            file_handler = logging.handlers.RotatingFileHandler(
+                "idle_usage_checker_logs.log",
+                maxBytes=1_000_000,
+                backupCount=3,
+            )
             file_handler.setFormatter(formatter)
-
-            logger.addHandler(file_handler)
+            handlers = [file_handler]
 
             if self.debug:
                 stream_handler = logging.StreamHandler()
                 stream_handler.setFormatter(formatter)
-                logger.addHandler(stream_handler)
+                handlers.append(stream_handler)
+
+            # Records are still formatted on the calling thread, but file
+            # and stream I/O happen on the listener's background thread
+            self._log_queue = queue.SimpleQueue()
+            logger.addHandler(logging.handlers.QueueHandler(self._log_queue))
+            self._queue_listener = logging.handlers.QueueListener(
+                self._log_queue, *handlers
+            )
+            self._queue_listener.start()
 
             return logger
 
         self.debug = kwargs.get("debug")
         self.logger = logger_setup()
+        self._stop_event = threading.Event()
+        self._closed_event = threading.Event()
+        self._stop_reason = "Interrupted."
+        self.running = True
         self.last_action = win32api.GetLastInputInfo()
 
+        # Prime the CPU counter so later non-blocking calls measure the
+        # time since the previous call
+        psutil.cpu_percent(interval=None)
+        self._last_sample_ts = float("-inf")
+        self._min_interval = 0.5
+        self._sns = None
+        self._pending = []
+
         if self.debug:
             # Set some constant values for debugging purposes
 
-            config["RUNNING_DURATION"] = 30
-            config["SLEEP_MODE_LENGTH"] = 5
-            config["CPU_THRESHOLD"] = 10
-            config["RESOURCE_CHECK_INTERVAL"] = 1
-            config["PRESENCE_WAIT_TIME"] = 1
-            config["PRESENCE_CHECK_COUNT"] = 3
+            config.RUNNING_DURATION = 30
+            config.SLEEP_MODE_LENGTH = 5
+            config.CPU_THRESHOLD = 10
+            config.RESOURCE_CHECK_INTERVAL = 1
+            config.PRESENCE_WAIT_TIME = 1
+            config.PRESENCE_CHECK_COUNT = 3
 
         self.logger.info("**********")
         self.logger.info("Initial setup complete.")
@@ -70,154 +119,229 @@ class Idle_Usage_Checker:
             """Start idle state after activity detection / resource check."""
 
             self.logger.info(
-                f"Entering sleep mode... "
-                f"({config['SLEEP_MODE_LENGTH']/60} minutes)"
+                "Entering sleep mode... (%s minutes)",
+                config.SLEEP_MODE_LENGTH / 60,
             )
-            config["ELAPSED_TIME"] += config["SLEEP_MODE_LENGTH"]
-            sleep(config["SLEEP_MODE_LENGTH"])
+            self.wait(config.SLEEP_MODE_LENGTH)
 
         if self.debug:
             self.logger.info("***** Debugging Mode *****")
 
+        # Console control events are delivered on a separate thread, so
+        # stop() can wake a blocked Event.wait
+        def console_ctrl_handler(ctrl_type: int) -> bool:
+            self.stop()
+            if ctrl_type in _TERMINATING_CTRL_EVENTS:
+                # Hold off termination until begin() has torn down
+                self._closed_event.wait(timeout=TEARDOWN_TIMEOUT)
+            return True
+
+        win32api.SetConsoleCtrlHandler(console_ctrl_handler, True)
+        self._deadline = threading.Timer(
+            config.RUNNING_DURATION, self.duration_reached
+        )
+        self._deadline.daemon = True
+        self._deadline.start()
         self.logger.info("Beginning main loop.")
         total_passed_resource_checks = 0
 
-        while config["ELAPSED_TIME"] <= config["RUNNING_DURATION"]:
-            self.logger.info("Checking for user presence...")
+        try:
+            while self.running and not self._stop_event.is_set():
+                self.logger.info("Checking for user presence...")
 
-            if not self.presence():
+                present = self.presence()
                 # Checks if user is present
-                if self.resource_utilization():
+                if not self.running:
+                    break
+
+                if not present:
+                    heavy_usage = self.resource_utilization()
                     # Checks resource utilization
-                    self.send_notification()
-                    # If resources are being utilized and user is not present,
-                    # AWS SNS sends a notification email and ends the loop
-                else:
-                    total_passed_resource_checks += 1
-
-                    if (
-                        total_passed_resource_checks
-                        >= config["MAX_PASSED_CHECKS"]
-                    ):
-                        self.close_program(
-                            message=(
-                                "Total passed resource checks have "
-                                "reached allowed maximum."
+                    if not self.running:
+                        break
+
+                    if heavy_usage:
+                        self.send_notification()
+                        # If resources are being utilized and user is not
+                        # present, AWS SNS sends a notification email and
+                        # ends the loop
+                    else:
+                        total_passed_resource_checks += 1
+
+                        if (
+                            total_passed_resource_checks
+                            >= config.MAX_PASSED_CHECKS
+                        ):
+                            self.close_program(
+                                message=(
+                                    "Total passed resource checks have "
+                                    "reached allowed maximum."
+                                )
                             )
-                        )
+                        else:
+                            sleep_mode()
+                else:
+                    total_passed_resource_checks = 0
+                    # Resets num of passed resorce checks if presence is
+                    # detected
                     sleep_mode()
-            else:
-                total_passed_resource_checks = 0
-                # Resets num of passed resorce checks if presence is detected
-                sleep_mode()
 
-        self.close_program(message="Maximum running duration reached.")
+            if self._stop_event.is_set():
+                self.close_program(message=self._stop_reason)
+        finally:
+            # Teardown runs even if a check or notification raises
+            self._deadline.cancel()
+            win32api.SetConsoleCtrlHandler(console_ctrl_handler, False)
+            self._queue_listener.stop()
+            self._sns = None
+            self._closed_event.set()
+
+    def stop(self) -> None:
+        """Request shutdown, waking any pending wait."""
+
+        self._stop_event.set()
+
+    def duration_reached(self) -> None:
+        """Request shutdown once RUNNING_DURATION has elapsed."""
+
+        # Runs on the Timer thread; closing is left to the main thread
+        self._stop_reason = "Maximum running duration reached."
+        self.stop()
+
+    def wait(self, seconds: float) -> bool:
+        """Wait for given duration; return False if stop was requested."""
+
+        if self._stop_event.wait(timeout=seconds):
+            self.close_program(message=self._stop_reason)
+            return False
+        return True
 
     def close_program(self, message: str = "") -> None:
-        """Log closing messages and exit program."""
+        """Log closing messages and end the main loop."""
+
+        # send_notification publishes immediately; this only catches
+        # entries queued by any future caller that doesn't flush
+        self._flush_notifications()
+
+        if not self.running:
+            # Already closing; only the first reason is logged
+            return
 
         if message:
             self.logger.info(message)
         self.logger.info("Closing program...")
-        sys.exit()
+        self.running = False
 
     def update_resources(self) -> None:
         """Get most recent resource levels."""
 
-        self.cpu, self.memory = (
-            psutil.cpu_percent(interval=0.6),
-            psutil.virtual_memory().percent,
-        )
+        now = monotonic()
+        if now - self._last_sample_ts < self._min_interval:
+            # Counters can't have meaningfully changed; keep last sample
+            return
+
+        # System-wide figures are needed here; Process.oneshot() only
+        # batches reads for a single process and does not apply
+        self.cpu = psutil.cpu_percent(interval=None)
+        self.memory = psutil.virtual_memory().percent
+        self._last_sample_ts = now
         self.logger.debug(
-            f"CPU usage is at {self.cpu}% and "
-            f"memory usage is at {self.memory}%."
+            "CPU usage is at %s%% and memory usage is at %s%%.",
+            self.cpu,
+            self.memory,
         )
 
     def resource_utilization(self) -> bool:
         """Check for resource utilization."""
 
-        resource_counter = 0
-        total_checks = 0
+        # Bind loop constants to locals once
+        cpu_thr = config.CPU_THRESHOLD
+        mem_thr = config.MEMORY_THRESHOLD
+        interval = config.RESOURCE_CHECK_INTERVAL
+        required = config.RESOURCE_CHECKS
+        max_checks = config.MAX_RESOURCE_CHECKS
+        wait = self.wait
+        update = self.update_resources
+
+        score = 0
+        samples = []
+        record = samples.append
         self.logger.info("Starting resource checks...")
 
-        while (
-            resource_counter < config["RESOURCE_CHECKS"]
-            and resource_counter > -config["RESOURCE_CHECKS"]
-            and total_checks < config["MAX_RESOURCE_CHECKS"]
-        ):
+        # Re-prime so the first sample covers one interval rather than the
+        # whole time since the previous resource check
+        psutil.cpu_percent(interval=None)
 
-            sleep(config["RESOURCE_CHECK_INTERVAL"])
-            self.update_resources()
+        for _ in range(max_checks):
 
-            if (
-                self.cpu >= config["CPU_THRESHOLD"]
-                or self.memory >= config["MEMORY_THRESHOLD"]
-            ):
-                verb = "are"
-                resource_counter += 1
-                total_checks += 1
+            if not wait(interval):
+                return False
+            update()
+            cpu, memory = self.cpu, self.memory
 
-            else:
-                verb = "are not"
-                resource_counter -= 1
-                total_checks += 1
-
-            self.logger.debug(
-                f"Resources {verb} being heavily utilized. "
-                "(Allowed CPU usage: "
-                f"{config['CPU_THRESHOLD']}%, "
-                "Allowed RAM usage: "
-                f"{config['MEMORY_THRESHOLD']}"
-                "%)"
-            )
+            # +1 for a heavily utilized sample, -1 otherwise
+            score += 1 if cpu >= cpu_thr or memory >= mem_thr else -1
+            record((cpu, memory))
 
-        total_checks_msg = f"(Total number of checks: {total_checks})"
+            if abs(score) >= required:
+                break
 
-        if resource_counter >= config["RESOURCE_CHECKS"]:
-            # Case of heavy resource usage
+        self.logger.debug(
+            "Resource samples (CPU%%, RAM%%): %r "
+            "(Allowed CPU usage: %s%%, Allowed RAM usage: %s%%)",
+            samples,
+            cpu_thr,
+            mem_thr,
+        )
+
+        total_checks = len(samples)
 
+        if score >= required:
+            # Case of heavy resource usage
             self.logger.warning(
-                "Computer has failed resource checks. " f"{total_checks_msg}"
+                "Computer has failed resource checks. "
+                "(Total number of checks: %s)",
+                total_checks,
             )
-            return True
-
-        elif resource_counter <= -config["RESOURCE_CHECKS"]:
+        elif score <= -required:
             # Case of light resource usage
-
             self.logger.info(
-                "Computer has passed resource checks. " f"{total_checks_msg}"
+                "Computer has passed resource checks. "
+                "(Total number of checks: %s)",
+                total_checks,
             )
-            return False
-
-        elif total_checks >= config["MAX_RESOURCE_CHECKS"]:
+        else:
             # Total number of checks exceeded
-
             self.logger.warning(
                 "Computer has reached maximum number of allowed checks. "
-                f"{total_checks_msg}"
+                "(Total number of checks: %s)",
+                total_checks,
             )
-            return False
-
-        else:
-            # Other error catcher
 
-            self.logger.error(
-                "An unknown error has occured in resource checks. "
-                f"{total_checks_msg}"
-            )
-            return False
+        return score >= required
 
     def presence(self) -> bool:
-        """Check for user presence."""
+        """Check for user presence (last keyboard or mouse input tick)."""
 
-        for _ in range(config["PRESENCE_CHECK_COUNT"]):
+        # Polling GetLastInputInfo is deliberate. A QS_INPUT message wait
+        # only sees this (windowless) process's own input. An out-of-context
+        # SetWinEventHook on EVENT_OBJECT_LOCATIONCHANGE is chatty and only
+        # sees mouse movement, missing keyboard activity. WH_KEYBOARD_LL/
+        # WH_MOUSE_LL hooks run synchronously in the system input path, so
+        # a busy GIL would lag the user's input. Either would only detect
+        # presence sooner in a case that is followed by sleep mode anyway.
+        for i in range(config.PRESENCE_CHECK_COUNT):
 
             new_action = win32api.GetLastInputInfo()
             if new_action != self.last_action:
                 self.logger.info("Activity detected.")
                 self.last_action = new_action
                 return True
-            sleep(config["PRESENCE_WAIT_TIME"])
+
+            if i < config.PRESENCE_CHECK_COUNT - 1:
+                # No need to wait after the final check
+                if not self.wait(config.PRESENCE_WAIT_TIME):
+                    return False
 
         self.logger.info("User does not seem to be present.")
         return False
@@ -228,66 +352,140 @@ class Idle_Usage_Checker:
         self.logger.info("Sending notification via AWS SNS...")
 
         if not self.debug:
-            client = boto3.client(
+            self._pending.append(
+                {
+                    "Id": str(uuid.uuid4()),
+                    "Message": _NOTIFY_TMPL.format(
+                        cpu=self.cpu,
+                        mem=self.memory,
+                        cpu_thr=config.CPU_THRESHOLD,
+                        mem_thr=config.MEMORY_THRESHOLD,
+                    ),
+                    "Subject": "Idle Checker Notification",
+                }
+            )
+
+        # Notifying always ends the run, so publish right away
+        if self._flush_notifications():
+            self.close_program(message="Notification has been sent.")
+        else:
+            self.close_program(message="Notification could not be sent.")
+
+    def _sns_client(self):
+        """Return SNS client, creating it on first use."""
+
+        if self._sns is None:
+            # Imported lazily; boto3 is slow to import and unused
+            # unless a notification is actually sent
+            import boto3
+            from botocore.config import Config
+
+            self._sns = boto3.client(
                 "sns",
                 aws_access_key_id=os.environ.get("AWS-Python-Access-Key-ID"),
                 aws_secret_access_key=os.environ.get(
                     "AWS-Python-Secret-Access-Key"
                 ),
                 region_name=os.environ.get("AWS-Region"),
-            )
-
-            client.publish(
-                TopicArn=os.environ.get("AWS-Python-Idle-Checker-TopicArn"),
-                Message=(
-                    f"Your CPU usage was recorded at {self.cpu}% "
-                    f"and your RAM usage was recorded at {self.memory}%. "
-                    "Allowed maximums: "
-                    f"CPU: {config['CPU_THRESHOLD']}% RAM: {config['MEMORY_THRESHOLD']}%"
-                    " Did you leave a task running?"
+                config=Config(
+                    max_pool_connections=50,
+                    retries={"max_attempts": 5, "mode": "standard"},
+                    connect_timeout=3,
+                    read_timeout=5,
                 ),
-                Subject="Idle Checker Notification",
             )
 
-        self.close_program(message="Notification has been sent.")
+        return self._sns
 
+    def _flush_notifications(self) -> bool:
+        """Publish queued notifications via AWS SNS in batches.
 
-def main() -> None:
-    """Start application."""
+        Return False if any notification could not be published.
+        """
 
-    def cmd_line_arg_handler() -> dict:
-        """Handle command line arguments."""
+        if not self._pending:
+            return True
 
-        opts = [opt for opt in sys.argv[1:] if opt.startswith("-")]
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        all_sent = True
+
+        while self._pending:
+            batch = self._pending[:SNS_BATCH_SIZE]
+            del self._pending[:SNS_BATCH_SIZE]
+
+            for attempt in range(SNS_PUBLISH_ATTEMPTS):
+                if attempt and self._stop_event.wait(timeout=2 ** attempt):
+                    # Shutdown requested; don't keep retrying
+                    break
+
+                try:
+                    response = self._sns_client().publish_batch(
+                        TopicArn=os.environ.get(
+                            "AWS-Python-Idle-Checker-TopicArn"
+                        ),
+                        PublishBatchRequestEntries=batch,
+                    )
+                except (BotoCoreError, ClientError) as error:
+                    # botocore has already retried what it can
+                    self.logger.error(
+                        "Publishing notifications failed; giving up on %s "
+                        "notification(s): %s",
+                        len(batch) + len(self._pending),
+                        error,
+                    )
+                    self._pending.clear()
+                    return False
+
+                # botocore doesn't retry individual failed entries; retry
+                # them here unless they are sender faults (bad input)
+                retry_ids = set()
+                for failure in response.get("Failed", []):
+                    self.logger.warning(
+                        "Notification %s failed to publish: %s",
+                        failure["Id"],
+                        failure.get("Message", failure.get("Code")),
+                    )
+                    if failure.get("SenderFault"):
+                        all_sent = False
+                    else:
+                        retry_ids.add(failure["Id"])
+
+                batch = [entry for entry in batch if entry["Id"] in retry_ids]
+                if not batch:
+                    break
+
+            if batch:
+                all_sent = False
+                self.logger.error(
+                    "Giving up on %s notification(s).", len(batch)
+                )
 
-        cmd_line_args = {"debug": False}
+        return all_sent
 
-        if opts:
 
-            if "-h" in opts or "--help" in opts:
-                print(
-                    "'Idle Usage Checker' by Jason Tarka\n"
-                    "Accepted command line arguments:\n"
-                    '"-d" - Enter debugging mode\n'
-                    '"-v" - Display version information'
-                )
-                sys.exit()
+_PARSER = argparse.ArgumentParser(
+    description="'Idle Usage Checker' by Jason Tarka",
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+)
+_PARSER.add_argument(
+    "-d", "--debug", action="store_true", help="Enter debugging mode"
+)
+_PARSER.add_argument(
+    "-v",
+    "--version",
+    action="version",
+    version=f"Application version: 1.0.0\nPython version: {sys.version}",
+    help="Display version information",
+)
 
-            if "-v" in opts or "--version" in opts:
-                print(
-                    "Application version: 1.0.0\n"
-                    f"Python version: {sys.version}"
-                )
-                sys.exit()
 
-            if "-d" in opts or "--debug" in opts:
-                cmd_line_args["debug"] = True
-
-        return cmd_line_args
+def main() -> None:
+    """Start application."""
 
-    debug = cmd_line_arg_handler().get("debug")
+    args = _PARSER.parse_args()
 
-    checker = Idle_Usage_Checker(debug=debug)
+    checker = Idle_Usage_Checker(debug=args.debug)
     checker.begin()
 
 